@@ -23,16 +23,23 @@ class Config:
     FAISS_INDEX_FILE = "faiss_index.bin"
     VECTOR_METADATA_FILE = "vector_metadata.json"
     DOCUMENT_STORE_FILE = "document_store.json"
+    EMBEDDING_CACHE_FILE = "embedding_cache.sqlite"  # 嵌入向量磁盘缓存（设为None禁用）
     
     # RAG参数配置
     CHUNK_SIZE = 512  # 文档切片大小
     CHUNK_OVERLAP = 50  # 切片重叠大小
     TOP_K = 5  # 检索返回的文档数量
     SIMILARITY_THRESHOLD = 0.7  # 相似度阈值
+    RETRIEVAL_CACHE_SIZE = 2048  # 检索结果缓存条数（按查询文本缓存）
     
     # 向量数据库参数
     VECTOR_DIMENSION = 768  # m3e-base向量维度
-    FAISS_INDEX_TYPE = "IndexFlatIP"  # FAISS索引类型 (内积)
+    FAISS_INDEX_TYPE = "IndexFlatIP"  # FAISS索引类型 (内积)，大规模语料可用 IndexIVFFlat / IndexIVFPQ
+    FAISS_IVF_NLIST = 100  # IVF聚类数（语料较少时自动减少）
+    FAISS_NPROBE = 10  # IVF检索时访问的聚类数
+    FAISS_PQ_M = 16  # PQ子向量个数（需整除向量维度）
+    FAISS_PQ_NBITS = 8  # 每个子向量的编码位数
+    FAISS_USE_GPU = False  # 是否将FAISS索引放到GPU上检索（需要faiss-gpu）
     VECTOR_NORMALIZE = True  # 是否标准化向量
     BATCH_ENCODE_SIZE = 32  # 批量编码大小
     
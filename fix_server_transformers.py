@@ -7,6 +7,7 @@
 import os
 import sys
 import subprocess
+import importlib.util
 
 def check_environment():
     """检查当前环境"""
@@ -138,13 +139,31 @@ def test_model_loading():
         )
         print("✅ tokenizer 加载成功")
         
-        print("步骤2: 加载模型...")
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16,
-            device_map="auto",
-            trust_remote_code=True
-        )
+        load_kwargs = {
+            "device_map": "auto",
+            "trust_remote_code": True
+        }
+        
+        # 默认与 rag_engine 一致按 FP16 加载；设置 TEST_LOAD_IN_4BIT=1 时改为 4-bit NF4 量化加载
+        # （权重显存约为 FP16 的 1/4，但走的是 bitsandbytes 加载路径，不能代表主程序的加载结果）
+        load_in_4bit = os.environ.get("TEST_LOAD_IN_4BIT") == "1"
+        if load_in_4bit and not (torch.cuda.is_available() and importlib.util.find_spec("bitsandbytes") is not None):
+            print("⚠️  TEST_LOAD_IN_4BIT=1 需要GPU和 bitsandbytes，改为 FP16 加载")
+            load_in_4bit = False
+        
+        if load_in_4bit:
+            from transformers import BitsAndBytesConfig
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_quant_type="nf4"
+            )
+            print("步骤2: 加载模型 (4-bit NF4 量化)...")
+        else:
+            load_kwargs["torch_dtype"] = torch.float16
+            print("步骤2: 加载模型 (FP16)...")
+        
+        model = AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs)
         print("✅ 模型加载成功！")
         print("🎉 问题已解决！")
         
@@ -6,92 +6,24 @@
 
 import os
 import sys
-import importlib.util
-from pathlib import Path
+
+from llm_utils import patch_parallel_styles
 
 def fix_transformers_bug():
     """修复 transformers 库中的 ALL_PARALLEL_STYLES 问题"""
     print("🔧 正在修复 transformers 库 bug...")
     
     try:
-        # 导入 transformers
-        import transformers
-        from transformers.modeling_utils import ALL_PARALLEL_STYLES
-        
-        # 检查是否存在问题
-        if ALL_PARALLEL_STYLES is None:
-            print("⚠️  发现 ALL_PARALLEL_STYLES 为 None，正在修复...")
-            
-            # 设置正确的并行样式
-            import transformers.modeling_utils as modeling_utils
-            modeling_utils.ALL_PARALLEL_STYLES = [
-                "model_parallel",
-                "pipeline_parallel", 
-                "tensor_parallel",
-                "data_parallel"
-            ]
-            
-            print("✅ 修复完成")
-            return True
+        if patch_parallel_styles():
+            print("⚠️  发现 ALL_PARALLEL_STYLES 为 None，已修复")
         else:
-            print("✅ ALL_PARALLEL_STYLES 正常，无需修复")
-            return True
+            print("✅ ALL_PARALLEL_STYLES 正常或已修复，无需再次修复")
+        return True
             
     except Exception as e:
         print(f"❌ 修复失败: {e}")
         return False
 
-def alternative_fix():
-    """替代方案：直接修补 modeling_utils.py 文件"""
-    print("\n🔧 尝试替代修复方案...")
-    
-    try:
-        import transformers
-        
-        # 获取 transformers 安装路径
-        transformers_path = Path(transformers.__file__).parent
-        modeling_utils_path = transformers_path / "modeling_utils.py"
-        
-        print(f"📁 transformers 路径: {modeling_utils_path}")
-        
-        if modeling_utils_path.exists():
-            # 读取文件内容
-            with open(modeling_utils_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 检查是否需要修复
-            if 'ALL_PARALLEL_STYLES = None' in content or 'ALL_PARALLEL_STYLES=None' in content:
-                print("⚠️  发现问题代码，正在修复...")
-                
-                # 替换问题代码
-                content = content.replace(
-                    'ALL_PARALLEL_STYLES = None',
-                    'ALL_PARALLEL_STYLES = ["model_parallel", "pipeline_parallel", "tensor_parallel", "data_parallel"]'
-                )
-                content = content.replace(
-                    'ALL_PARALLEL_STYLES=None',
-                    'ALL_PARALLEL_STYLES=["model_parallel", "pipeline_parallel", "tensor_parallel", "data_parallel"]'
-                )
-                
-                # 备份原文件
-                backup_path = modeling_utils_path.with_suffix('.py.backup')
-                modeling_utils_path.rename(backup_path)
-                print(f"📦 已备份原文件到: {backup_path}")
-                
-                # 写入修复后的内容
-                with open(modeling_utils_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
-                print("✅ 文件修复完成")
-                return True
-            else:
-                print("✅ 文件中未发现问题代码")
-                return True
-                
-    except Exception as e:
-        print(f"❌ 替代修复失败: {e}")
-        return False
-
 def test_model_loading():
     """测试模型加载是否正常"""
     print("\n🧪 测试模型加载...")
@@ -142,13 +74,7 @@ def main():
             print("🎉 问题已解决！")
             return
     
-    # 方案2：文件修复
-    print("\n方案1失败，尝试方案2...")
-    if alternative_fix():
-        print("✅ 文件修复成功，请重新导入 transformers 后测试")
-        return
-    
-    # 方案3：版本解决方案
+    # 方案2：版本解决方案
     print("\n" + "="*60)
     print("🔍 推荐解决方案")
     print("="*60)
@@ -161,8 +87,10 @@ def main():
     print("3. 设置环境变量:")
     print("   export TRANSFORMERS_VERBOSITY=error")
     print()
-    print("4. 手动修复 (运行此脚本):")
-    print("   python fix_transformers_issue.py")
+    print("4. 在主程序中修复:")
+    print("   运行时修复只在当前进程内有效；main.py (rag_engine.SimpleLLM) 与")
+    print("   main_fixed.py (rag_engine_fixed.py) 都会在加载模型前自动修补 ALL_PARALLEL_STYLES")
+    print("   python main.py 或 python main_fixed.py")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+LLM 公共工具函数
+rag_engine.py 与 rag_engine_fixed.py 的批量生成共用
+"""
+
+import sys
+from typing import List
+
+# 部分 transformers 版本中 modeling_utils.ALL_PARALLEL_STYLES 为 None，加载模型时会报 NoneType 错误
+_DEFAULT_PARALLEL_STYLES = (
+    "model_parallel",
+    "pipeline_parallel",
+    "tensor_parallel",
+    "data_parallel",
+)
+_parallel_styles_patched = False
+
+
+def patch_parallel_styles() -> bool:
+    """在内存中修补 ALL_PARALLEL_STYLES，每个解释器只执行一次，返回本次是否做了修改
+
+    需在 transformers 导入之后、from_pretrained 之前调用，不修改已安装的源码
+    """
+    global _parallel_styles_patched
+    if _parallel_styles_patched:
+        return False
+    modeling_utils = sys.modules.get("transformers.modeling_utils")
+    if modeling_utils is None:
+        import transformers.modeling_utils as modeling_utils
+    _parallel_styles_patched = True
+    if getattr(modeling_utils, 'ALL_PARALLEL_STYLES', None) is None:
+        modeling_utils.ALL_PARALLEL_STYLES = list(_DEFAULT_PARALLEL_STYLES)
+        return True
+    return False
+
+
+def tokenize_left_padded(tokenizer, texts: List[str]):
+    """左侧填充后批量编码，返回 PyTorch 张量
+
+    仅解码器模型批量生成时需要左侧填充，保证新生成的token紧接在提示词之后；
+    tokenizer 没有 pad_token 时使用 eos_token，编码后恢复原来的 padding_side。
+    """
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        return tokenizer(texts, return_tensors="pt", padding=True)
+    finally:
+        tokenizer.padding_side = padding_side
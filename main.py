@@ -3,18 +3,27 @@
 """
 
 import os
+import csv
+import codecs
 import json
+import mmap
 import argparse
 import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 
-import pandas as pd
 from tqdm import tqdm
 
 from config import Config
 from rag_engine import RAGEngine
 
+# 可选依赖：orjson，用于加载测试数据和写出结果文件
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 
 class FinancialQASystem:
     """金融监管制度智能问答系统主类"""
@@ -24,6 +33,10 @@ class FinancialQASystem:
         self.rag_engine = None
         self.results = []
         
+        # 输出目录只构造一次，首次写入结果时再创建（之后不再重复检查）
+        self.output_dir = Path(self.config.OUTPUT_DIR)
+        self._output_dir_ready = False
+        
     def initialize(self):
         """初始化系统"""
         print("初始化金融监管制度智能问答系统...")
@@ -67,35 +80,57 @@ class FinancialQASystem:
         if not test_path.exists():
             print(f"测试数据文件不存在: {self.config.TEST_DATA_PATH}")
             return []
+        
+        if test_path.stat().st_size == 0:
+            print(f"❌ 测试数据文件为空: {self.config.TEST_DATA_PATH}")
+            return []
             
+        # 直接解析字节，省去文本解码（orjson.JSONDecodeError 是 json.JSONDecodeError 的子类）
+        loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+        
         try:
-            # 首先尝试标准JSON格式
-            with open(test_path, 'r', encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        questions = data
-                    else:
-                        questions = [data]
-                    print(f"✅ 使用标准JSON格式成功加载 {len(questions)} 个问题")
-                    return questions
-                except json.JSONDecodeError:
-                    print("标准JSON格式解析失败，尝试JSONL格式...")
+            with open(test_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # 跳过UTF-8 BOM
+                start = len(codecs.BOM_UTF8) if mm[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+                
+                # 首个非空行能单独解析为JSON对象即为JSONL，常见的JSONL文件不再先做一次失败的整体解析；
+                # 否则（多行JSON对象、JSON数组等）先按标准JSON整体解析
+                is_jsonl = False
+                for _, first_line in self._iter_lines(mm, start):
+                    first_line = first_line.strip()
+                    if not first_line:
+                        continue
+                    try:
+                        is_jsonl = isinstance(loads(first_line), dict)
+                    except json.JSONDecodeError:
+                        pass
+                    break
+                
+                if not is_jsonl:
+                    try:
+                        data = loads(mm[start:])
+                        if isinstance(data, list):
+                            questions = data
+                        else:
+                            questions = [data]
+                        print(f"✅ 使用标准JSON格式成功加载 {len(questions)} 个问题")
+                        return questions
+                    except json.JSONDecodeError:
+                        print("标准JSON格式解析失败，尝试JSONL格式...")
                     
-            # 尝试JSONL格式（每行一个JSON对象）
-            questions = []
-            with open(test_path, 'r', encoding='utf-8') as f:
-                for line_no, line in enumerate(f, 1):
+                # JSONL格式（每行一个JSON对象），在内存映射上逐行切片
+                questions = []
+                for line_no, line in self._iter_lines(mm, start):
                     line = line.strip()
                     if not line:  # 跳过空行
                         continue
                         
                     try:
-                        question_data = json.loads(line)
+                        question_data = loads(line)
                         questions.append(question_data)
                     except json.JSONDecodeError as e:
                         print(f"警告：解析第{line_no}行时出错: {e}")
-                        print(f"问题行内容: {line[:100]}...")
+                        print(f"问题行内容: {line.decode('utf-8', errors='replace')[:100]}...")
                         continue
                         
             if questions:
@@ -109,15 +144,31 @@ class FinancialQASystem:
                 
                 return questions
             else:
-                print("❌ JSONL格式解析也失败了")
+                print("❌ JSONL格式解析失败，未得到任何问题")
                 return []
                 
         except Exception as e:
             print(f"加载测试数据失败: {e}")
             return []
     
-    def process_question(self, question_data: Dict[str, Any]) -> Dict[str, Any]:
-        """处理单个问题"""
+    @staticmethod
+    def _iter_lines(buffer, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """从 start 偏移起按换行符逐行切出字节串（行号从1开始），不做文本解码"""
+        pos = start
+        size = len(buffer)
+        line_no = 0
+        while pos < size:
+            end = buffer.find(b'\n', pos)
+            if end == -1:
+                end = size
+            line_no += 1
+            yield line_no, buffer[pos:end]
+            pos = end + 1
+    
+    def process_question(self, question_data: Dict[str, Any], timestamp: str = None) -> Dict[str, Any]:
+        """处理单个问题（timestamp 为空时取当前时间）"""
+        if timestamp is None:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         question_id = question_data.get('id', 'unknown')
         category = question_data.get('category', '问答题')
         question = question_data.get('question', '')
@@ -128,32 +179,12 @@ class FinancialQASystem:
         print(f"问题: {question}")
         
         # 构建完整问题（对于选择题，包含选项）
-        if category == "选择题" and content:
-            full_question = f"{question}\n{content}"
-        else:
-            full_question = question
+        full_question = self._build_full_question(question_data)
             
         # 调用RAG引擎回答问题
         try:
             result = self.rag_engine.answer_question(full_question, category)
-            
-            # 整理结果
-            processed_result = {
-                "id": question_id,
-                "category": category,
-                "question": question,
-                "content": content,
-                "answer": result.get("answer", ""),
-                "context_used": result.get("context_used", ""),
-                "num_sources": result.get("num_sources", 0),
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # 如果有错误，记录错误信息
-            if "error" in result:
-                processed_result["error"] = result["error"]
-                
-            return processed_result
+            return self._build_result(question_data, result, timestamp)
             
         except Exception as e:
             print(f"处理问题时发生错误: {e}")
@@ -164,53 +195,127 @@ class FinancialQASystem:
                 "content": content,
                 "answer": f"处理失败: {e}",
                 "error": str(e),
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+                "timestamp": timestamp
             }
     
+    def _build_result(self, question_data: Dict[str, Any], result: Dict[str, Any], timestamp: str) -> Dict[str, Any]:
+        """将RAG引擎的回答整理为输出结果"""
+        processed_result = {
+            "id": question_data.get('id', 'unknown'),
+            "category": question_data.get('category', '问答题'),
+            "question": question_data.get('question', ''),
+            "content": question_data.get('content', ''),
+            "answer": result.get("answer", ""),
+            "context_used": result.get("context_used", ""),
+            "num_sources": result.get("num_sources", 0),
+            "timestamp": timestamp
+        }
+        
+        # 如果有错误，记录错误信息
+        if "error" in result:
+            processed_result["error"] = result["error"]
+            
+        return processed_result
+    
+    def _build_full_question(self, question_data: Dict[str, Any]) -> str:
+        """构建完整问题（对于选择题，包含选项）"""
+        question = question_data.get('question', '')
+        content = question_data.get('content', '')
+        if question_data.get('category', '问答题') == "选择题" and content:
+            return f"{question}\n{content}"
+        return question
+    
     def process_batch(self, questions: List[Dict[str, Any]], start_idx: int = 0, end_idx: int = None) -> List[Dict[str, Any]]:
         """批量处理问题"""
         if end_idx is None:
             end_idx = len(questions)
             
         print(f"开始批量处理问题 {start_idx} 到 {end_idx}")
+        batch = questions[start_idx:end_idx]
+        
+        # 整批问题一次检索、一次批量生成；失败时（如显存不足）回退为逐题处理
+        try:
+            rag_results = self.rag_engine.answer_questions_batch(
+                [self._build_full_question(q) for q in batch],
+                [q.get('category', '问答题') for q in batch]
+            )
+        except Exception as e:
+            print(f"批量回答失败，将逐题处理: {e}")
+            rag_results = None
+        
+        # 同一批次的结果共用一个时间戳
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         
         batch_results = []
-        for i in tqdm(range(start_idx, min(end_idx, len(questions))), desc="处理问题"):
-            question_data = questions[i]
-            result = self.process_question(question_data)
+        for i, question_data in enumerate(batch, start_idx):
+            if rag_results is None:
+                result = self.process_question(question_data, timestamp)
+            else:
+                result = self._build_result(question_data, rag_results[i - start_idx], timestamp)
             batch_results.append(result)
-            
-            # 定期清理GPU缓存
-            if (i + 1) % 5 == 0:
-                self.rag_engine.cleanup()
                 
         return batch_results
     
-    def save_results(self, results: List[Dict[str, Any]], output_file: str = None):
-        """保存结果"""
+    def save_results(self, results: List[Dict[str, Any]], output_file: str = None, compact: bool = False):
+        """保存结果（compact=True 时输出不缩进的紧凑JSON）"""
         if output_file is None:
             timestamp = time.strftime("%Y%m%d_%H%M%S")
-            output_file = f"{self.config.OUTPUT_DIR}/results_{timestamp}.json"
-            
-        output_path = Path(output_file)
-        output_path.parent.mkdir(exist_ok=True)
+            output_path = self.output_dir / f"results_{timestamp}.json"
+        else:
+            output_path = Path(output_file)
         
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
+            if output_path.parent == self.output_dir:
+                self._ensure_output_dir()
+            else:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            if ORJSON_AVAILABLE:
+                option = orjson.OPT_NON_STR_KEYS if compact else orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                with open(output_path, 'wb') as f:
+                    f.write(orjson.dumps(results, option=option))
+            else:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    if compact:
+                        json.dump(results, f, ensure_ascii=False, separators=(',', ':'))
+                    else:
+                        json.dump(results, f, ensure_ascii=False, indent=2)
                 
-            print(f"结果已保存到: {output_file}")
+            print(f"结果已保存到: {output_path}")
             
             # 同时保存为CSV格式以便查看
+            # 列为所有结果字段的并集（按首次出现顺序），缺失字段留空
             csv_file = output_path.with_suffix('.csv')
-            df = pd.DataFrame(results)
-            df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+            fieldnames = list(dict.fromkeys(key for result in results for key in result))
+            with open(csv_file, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(results)
             print(f"结果CSV文件已保存到: {csv_file}")
             
         except Exception as e:
             print(f"保存结果失败: {e}")
     
-    def run_test(self, force_rebuild: bool = False, batch_size: int = None, start_idx: int = 0, end_idx: int = None):
+    def _ensure_output_dir(self):
+        """首次写入结果前创建输出目录"""
+        if not self._output_dir_ready:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._output_dir_ready = True
+    
+    def _append_jsonl(self, path: Path, rows: List[Dict[str, Any]]):
+        """以JSONL格式追加写入结果，每批只写新增的行，中断时已完成的批次不会丢失"""
+        self._ensure_output_dir()
+        
+        if ORJSON_AVAILABLE:
+            data = b''.join(orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS) + b'\n' for row in rows)
+        else:
+            data = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+        
+        with open(path, 'ab') as f:
+            f.write(data)
+    
+    def run_test(self, force_rebuild: bool = False, batch_size: int = None, start_idx: int = 0, end_idx: int = None,
+                 compact_output: bool = False):
         """运行完整测试"""
         print("开始运行金融监管制度智能问答测试")
         
@@ -238,9 +343,14 @@ class FinancialQASystem:
             
         print(f"将处理 {end_idx - start_idx} 个问题 (索引 {start_idx} 到 {end_idx - 1})")
         
+        # 各批次的中间结果追加写入同一个JSONL文件
+        run_timestamp = time.strftime("%Y%m%d_%H%M%S")
+        intermediate_file = self.output_dir / f"batch_results_{run_timestamp}.jsonl"
+        
         # 分批处理
         all_results = []
-        for batch_start in range(start_idx, end_idx, batch_size):
+        # 耗时的检索和生成以批为单位进行，进度条按批次显示
+        for batch_start in tqdm(range(start_idx, end_idx, batch_size), desc="处理批次"):
             batch_end = min(batch_start + batch_size, end_idx)
             
             print(f"\n处理批次 {batch_start}-{batch_end-1}")
@@ -248,14 +358,19 @@ class FinancialQASystem:
             all_results.extend(batch_results)
             
             # 保存中间结果
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            intermediate_file = f"{self.config.OUTPUT_DIR}/batch_results_{batch_start}_{batch_end-1}_{timestamp}.json"
-            self.save_results(batch_results, intermediate_file)
+            try:
+                self._append_jsonl(intermediate_file, batch_results)
+                print(f"中间结果已追加到: {intermediate_file}")
+            except Exception as e:
+                print(f"保存中间结果失败: {e}")
             
+            # 显存在全部批次结束后统一清理
             print(f"批次 {batch_start}-{batch_end-1} 处理完成")
             
+        self.rag_engine.cleanup()
+        
         # 保存最终结果
-        self.save_results(all_results)
+        self.save_results(all_results, compact=compact_output)
         
         # 打印统计信息
         self.print_statistics(all_results)
@@ -269,10 +384,22 @@ class FinancialQASystem:
         print("测试统计信息")
         print("="*50)
         
+        # 单次遍历完成分类计数、失败计数和检索源数量累加
         total_questions = len(results)
-        choice_questions = sum(1 for r in results if r.get('category') == '选择题')
-        qa_questions = sum(1 for r in results if r.get('category') == '问答题')
-        error_count = sum(1 for r in results if 'error' in r)
+        choice_questions = 0
+        qa_questions = 0
+        error_count = 0
+        sources_sum = 0
+        for r in results:
+            category = r.get('category')
+            if category == '选择题':
+                choice_questions += 1
+            elif category == '问答题':
+                qa_questions += 1
+            if 'error' in r:
+                error_count += 1
+            else:
+                sources_sum += r.get('num_sources', 0)
         
         print(f"总问题数: {total_questions}")
         print(f"选择题数: {choice_questions}")
@@ -281,7 +408,7 @@ class FinancialQASystem:
         print(f"成功率: {((total_questions - error_count) / total_questions * 100):.2f}%")
         
         # 统计平均检索源数量
-        avg_sources = sum(r.get('num_sources', 0) for r in results if 'error' not in r) / max(1, total_questions - error_count)
+        avg_sources = sources_sum / max(1, total_questions - error_count)
         print(f"平均检索源数量: {avg_sources:.2f}")
         
         # 显示向量数据库统计
@@ -329,6 +456,7 @@ def main():
     parser.add_argument("--batch-size", type=int, default=10, help="批处理大小")
     parser.add_argument("--start-idx", type=int, default=0, help="开始索引")
     parser.add_argument("--end-idx", type=int, help="结束索引")
+    parser.add_argument("--compact-output", action="store_true", help="最终结果保存为紧凑JSON（不缩进）")
     parser.add_argument("--interactive", action="store_true", help="交互式问答模式")
     parser.add_argument("--vector-info", action="store_true", help="显示向量数据库信息")
     parser.add_argument("--rebuild-vector", action="store_true", help="重建向量数据库")
@@ -380,7 +508,8 @@ def main():
             force_rebuild=args.force_rebuild,
             batch_size=args.batch_size,
             start_idx=args.start_idx,
-            end_idx=args.end_idx
+            end_idx=args.end_idx,
+            compact_output=args.compact_output
         )
 
 
@@ -8,11 +8,23 @@ import json
 import os
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any
+import torch
 from rag_engine_fixed import FixedRAGEngine
 from config import Config
 
+# 可选依赖：orjson 解析/序列化比标准库 json 快数倍
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 支持的文档格式
+SUPPORTED_FORMATS = frozenset({'.txt', '.md', '.json'})
+
 class FinancialQASystem:
     """金融问答系统 - 修复版本"""
     
@@ -32,23 +44,46 @@ class FinancialQASystem:
             print(f"❌ 文档目录不存在: {doc_dir}")
             return documents
         
-        # 支持的文件格式
-        supported_formats = ['.txt', '.md', '.json']
+        # 文件读取期间会释放GIL，用线程池让多个文件的IO重叠进行
+        entries = list(self._iter_document_files(doc_dir))
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
         
-        for file_path in doc_path.rglob('*'):
-            if file_path.is_file() and file_path.suffix in supported_formats:
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read().strip()
-                        if content:
-                            documents.append(content)
-                            print(f"✅ 已加载: {file_path.name}")
-                except Exception as e:
-                    print(f"⚠️  跳过文件 {file_path.name}: {e}")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            read_results = executor.map(self._read_document, entries)
+            for entry, (content, error) in zip(entries, read_results):
+                if error is not None:
+                    print(f"⚠️  跳过文件 {entry.name}: {error}")
+                elif content:
+                    documents.append(content)
+                    print(f"✅ 已加载: {entry.name}")
         
         print(f"📊 总共加载了 {len(documents)} 个文档")
         return documents
     
+    def _read_document(self, entry):
+        """读取单个文档，返回 (内容, 异常)"""
+        try:
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                return f.read().strip(), None
+        except Exception as e:
+            return "", e
+    
+    def _iter_document_files(self, doc_dir: str):
+        """递归遍历目录，产出支持格式的文件
+        
+        os.scandir 返回的 DirEntry 在多数文件系统上自带文件类型（d_type），
+        判断目录/文件时无需像 rglob + is_file 那样逐个 stat。
+        空文件由读取后的内容判断跳过。
+        """
+        pending_dirs = [doc_dir]
+        while pending_dirs:
+            with os.scandir(pending_dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1] in SUPPORTED_FORMATS:
+                        yield entry
+    
     def initialize_system(self):
         """初始化系统"""
         print("="*60)
@@ -101,8 +136,9 @@ class FinancialQASystem:
         print(f"📝 加载测试数据: {test_file}")
         
         try:
-            with open(test_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(test_file, 'rb') as f:
+                raw = f.read()
+            data = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
             
             print(f"✅ 加载了 {len(data)} 个测试题目")
             return data
@@ -110,8 +146,8 @@ class FinancialQASystem:
             print(f"❌ 加载测试数据失败: {e}")
             return []
     
-    def process_question(self, question_data: Dict) -> Dict:
-        """处理单个问题"""
+    def process_question(self, question_data: Dict, query_result: Dict = None) -> Dict:
+        """处理单个问题（query_result 为批量查询得到的结果时不再单独查询）"""
         question_id = question_data.get('id', 'unknown')
         category = question_data.get('category', '未知')
         question = question_data.get('question', '')
@@ -121,8 +157,11 @@ class FinancialQASystem:
         print(f"问题: {question}")
         
         try:
-            # 使用RAG引擎查询
-            result = self.rag_engine.query(question)
+            if query_result is None:
+                # 使用RAG引擎查询（推理模式下不记录autograd信息，减少开销和显存占用）
+                with torch.inference_mode():
+                    query_result = self.rag_engine.query(question)
+            result = query_result
             
             # 根据题目类型处理答案
             if category == "选择题" and content:
@@ -159,18 +198,20 @@ class FinancialQASystem:
     def process_multiple_choice(self, question: str, content: str, 
                               generated_answer: str, retrieved_texts: List[str]) -> str:
         """处理选择题"""
-        # 简单的选择题处理逻辑
-        options = content.split('\n')
+        # 简单的选择题处理逻辑：每个选项只解析一次
+        options = [option for option in content.split('\n') if option.strip()]
         
-        # 在生成的答案中查找选项
+        # 在生成的答案中查找选项（按选项顺序，先命中者优先）
         for option in options:
-            if option.strip():
-                option_letter = option.split('.')[0].strip()
-                option_text = option.split('.', 1)[1].strip() if '.' in option else option
-                
-                # 检查答案中是否包含该选项的关键信息
-                if any(keyword in generated_answer for keyword in option_text.split()[:3]):
-                    return f"{option_letter}. {option_text}"
+            option_letter, has_dot, option_text = option.partition('.')
+            if has_dot:
+                option_letter, option_text = option_letter.strip(), option_text.strip()
+            else:
+                option_letter = option_text = option
+            
+            # 检查答案中是否包含该选项的关键信息
+            if any(keyword in generated_answer for keyword in option_text.split()[:3]):
+                return f"{option_letter}. {option_text}"
         
         # 如果无法匹配，返回第一个选项（保守策略）
         first_option = options[0].strip() if options else "A"
@@ -199,18 +240,21 @@ class FinancialQASystem:
             batch = test_data[i:i+batch_size]
             print(f"\n📦 处理批次 {i//batch_size + 1}/{(total_questions-1)//batch_size + 1}")
             
-            for question_data in batch:
-                result = self.process_question(question_data)
+            # 整个批次合并为一次生成调用
+            with torch.inference_mode():
+                query_results = self.rag_engine.query_batch(
+                    [question_data.get('question', '') for question_data in batch]
+                )
+            
+            for question_data, query_result in zip(batch, query_results):
+                result = self.process_question(question_data, query_result)
                 results.append(result)
                 
                 # 显示处理结果
                 print(f"✅ 题目 {result['id']}: {result['answer'][:100]}...")
             
-            # 批次间清理GPU内存
-            if hasattr(self.rag_engine, 'llm') and self.rag_engine.llm:
-                import torch
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
+            # 批次间不调用 empty_cache：它会同步设备并把缓存还给驱动，
+            # 下一批反而要重新 cudaMalloc；显存统一在 cleanup() 中释放
             
             print(f"📊 批次完成，已处理 {min(i+batch_size, total_questions)}/{total_questions} 个题目")
         
@@ -228,8 +272,12 @@ class FinancialQASystem:
         print(f"\n💾 保存结果到: {output_file}")
         
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
+            if ORJSON_AVAILABLE:
+                with open(output_file, 'wb') as f:
+                    f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            else:
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, ensure_ascii=False, indent=2)
             print("✅ 结果保存成功")
         except Exception as e:
             print(f"❌ 保存结果失败: {e}")
@@ -240,11 +288,20 @@ class FinancialQASystem:
         print("📊 测试统计")
         print("="*60)
         
+        # 单次遍历完成分类计数和置信度累加
         total = len(results)
-        choice_questions = len([r for r in results if r['category'] == '选择题'])
-        qa_questions = len([r for r in results if r['category'] == '问答题'])
+        choice_questions = 0
+        qa_questions = 0
+        confidence_sum = 0.0
+        for r in results:
+            category = r['category']
+            if category == '选择题':
+                choice_questions += 1
+            elif category == '问答题':
+                qa_questions += 1
+            confidence_sum += r['confidence']
         
-        avg_confidence = sum(r['confidence'] for r in results) / total if total > 0 else 0
+        avg_confidence = confidence_sum / total if total > 0 else 0
         
         print(f"总题目数: {total}")
         print(f"选择题: {choice_questions}")
@@ -8,6 +8,7 @@ import os
 import json
 import gc
 import torch
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from tqdm import tqdm
@@ -58,6 +59,7 @@ except ImportError:
     PANDAS_AVAILABLE = False
 
 from config import Config
+from llm_utils import patch_parallel_styles, tokenize_left_padded
 from vector_db import VectorDatabase
 
 
@@ -231,6 +233,8 @@ class SimpleLLM:
             
         try:
             print(f"加载LLM模型: {self.model_path}")
+            if patch_parallel_styles():
+                print("⚠️ 发现 ALL_PARALLEL_STYLES 为 None，已在内存中修复")
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_path,
                 trust_remote_code=True
@@ -255,18 +259,7 @@ class SimpleLLM:
             return "模型未加载，无法生成回答"
             
         try:
-            # 构建对话格式
-            messages = [
-                {"role": "system", "content": "你是一个专业的金融监管制度问答助手。"},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # 使用聊天模板
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
+            text = self._build_chat_text(prompt)
             
             # 编码输入
             inputs = self.tokenizer.encode(text, return_tensors="pt").to(self.device)
@@ -293,6 +286,42 @@ class SimpleLLM:
         except Exception as e:
             print(f"生成回答时出错: {e}")
             return f"生成回答时出现错误: {e}"
+    
+    def generate_batch(self, prompts: List[str], max_length: int = 2048) -> List[str]:
+        """一次 generate 调用为多个提示词生成回答（出错时抛出异常，由调用方回退逐条生成）"""
+        if not self.model or not self.tokenizer:
+            return ["模型未加载，无法生成回答"] * len(prompts)
+        
+        texts = [self._build_chat_text(prompt) for prompt in prompts]
+        inputs = tokenize_left_padded(self.tokenizer, texts).to(self.device)
+        
+        prompt_length = inputs["input_ids"].shape[1]
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_length=min(prompt_length + max_length, 4096),
+                temperature=0.1,
+                do_sample=True,
+                top_p=0.8,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        
+        return [
+            self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
+    
+    def _build_chat_text(self, prompt: str) -> str:
+        """使用聊天模板构建对话格式的输入文本"""
+        messages = [
+            {"role": "system", "content": "你是一个专业的金融监管制度问答助手。"},
+            {"role": "user", "content": prompt}
+        ]
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
 
 
 class SimpleEmbedding:
@@ -313,6 +342,11 @@ class SimpleEmbedding:
             print(f"❌ 嵌入模型加载失败: {e}")
             self.model = None
     
+    @property
+    def is_loaded(self) -> bool:
+        """模型是否加载成功（未加载时编码返回随机向量）"""
+        return self.model is not None
+    
     def get_text_embedding(self, text: str):
         """获取文本嵌入"""
         if not self.model:
@@ -337,9 +371,9 @@ class SimpleEmbedding:
         try:
             return self.model.encode(texts, **kwargs)
         except Exception as e:
+            # 模型已加载但编码失败时直接报错，避免随机向量混入索引和嵌入缓存
             print(f"批量编码失败: {e}")
-            import numpy as np
-            return np.random.random((len(texts), 768))
+            raise
 
 
 class RAGEngine:
@@ -351,6 +385,7 @@ class RAGEngine:
         self.embed_model = None
         self.doc_processor = DocumentProcessor()
         self.vector_db = None
+        self._retrieval_cache = OrderedDict()  # 查询文本 -> 检索结果（LRU）
         
         # 初始化模型
         self._init_models()
@@ -392,6 +427,9 @@ class RAGEngine:
         """构建或加载向量索引"""
         print("构建向量索引...")
         
+        # 索引变化后旧的检索结果不再有效
+        self._retrieval_cache.clear()
+        
         # 尝试从向量数据库加载
         if not force_rebuild and self.vector_db.can_load_existing():
             if self.vector_db.load_from_disk():
@@ -437,6 +475,14 @@ class RAGEngine:
             
         print(f"检索查询: {query}")
         
+        # 相同问题直接复用检索结果，省去一次编码和向量搜索
+        cache_key = query.strip()
+        cached = self._retrieval_cache.get(cache_key)
+        if cached is not None:
+            self._retrieval_cache.move_to_end(cache_key)
+            print(f"命中检索缓存，共 {len(cached)} 个相关文档片段")
+            return list(cached)
+        
         # 使用向量数据库搜索
         search_results = self.vector_db.search(query, top_k=self.config.TOP_K)
         
@@ -447,12 +493,45 @@ class RAGEngine:
             print(f"检索到相关文档片段 (分数: {result['score']:.4f}): {result['text'][:100]}...")
             
         print(f"共检索到 {len(contexts)} 个相关文档片段")
+        self._cache_retrieval(cache_key, contexts)
         return contexts
     
-    def generate_answer(self, question: str, context: str, question_type: str) -> str:
-        """生成答案"""
-        print(f"生成答案 - 问题类型: {question_type}")
+    def retrieve_documents_batch(self, queries: List[str]) -> List[List[str]]:
+        """批量检索：未命中缓存的查询一次性编码和搜索，结果同时写入检索缓存"""
+        if not self.vector_db.is_loaded:
+            raise ValueError("向量数据库未加载")
         
+        cache_keys = [query.strip() for query in queries]
+        fetched = {key: list(self._retrieval_cache[key])
+                   for key in cache_keys if key in self._retrieval_cache}
+        missing = [key for key in dict.fromkeys(cache_keys) if key not in fetched]
+        
+        for key in fetched:
+            print(f"命中检索缓存: {key[:100]}，共 {len(fetched[key])} 个相关文档片段")
+        
+        if missing:
+            print(f"批量检索 {len(missing)} 个查询（{len(fetched)} 个命中缓存）")
+            search_results = self.vector_db.search_batch(missing, top_k=self.config.TOP_K)
+            for key, results in zip(missing, search_results):
+                print(f"检索查询: {key}")
+                for result in results:
+                    print(f"检索到相关文档片段 (分数: {result['score']:.4f}): {result['text'][:100]}...")
+                print(f"共检索到 {len(results)} 个相关文档片段")
+                
+                fetched[key] = [result['text'] for result in results]
+                self._cache_retrieval(key, fetched[key])
+        
+        return [list(fetched[key]) for key in cache_keys]
+    
+    def _cache_retrieval(self, cache_key: str, contexts: List[str]):
+        """写入检索缓存，超过容量时淘汰最久未使用的条目"""
+        self._retrieval_cache[cache_key] = tuple(contexts)
+        self._retrieval_cache.move_to_end(cache_key)
+        while len(self._retrieval_cache) > self.config.RETRIEVAL_CACHE_SIZE:
+            self._retrieval_cache.popitem(last=False)
+    
+    def _build_prompt(self, question: str, context: str, question_type: str) -> str:
+        """根据问题类型构建提示词"""
         if question_type == "选择题":
             # 解析选择题的选项
             parts = question.split('\n')
@@ -473,7 +552,13 @@ class RAGEngine:
                 context=context,
                 question=question
             )
+        return prompt
+    
+    def generate_answer(self, question: str, context: str, question_type: str) -> str:
+        """生成答案"""
+        print(f"生成答案 - 问题类型: {question_type}")
         
+        prompt = self._build_prompt(question, context, question_type)
         print(f"生成的提示词长度: {len(prompt)}")
         
         try:
@@ -533,6 +618,57 @@ class RAGEngine:
                 "error": str(e)
             }
     
+    def answer_questions_batch(self, questions: List[str], question_types: List[str]) -> List[Dict[str, Any]]:
+        """批量回答问题：整批检索一次，所有提示词合并为一次批量生成"""
+        print(f"\n{'='*50}")
+        print(f"开始批量处理 {len(questions)} 个问题")
+        
+        contexts_list = self.retrieve_documents_batch(questions)
+        
+        results = [None] * len(questions)
+        pending = []  # (问题索引, 提示词, 合并后的上下文)
+        for i, (question, question_type, contexts) in enumerate(zip(questions, question_types, contexts_list)):
+            print(f"问题 {i+1}/{len(questions)}: {question[:100]}... (类型: {question_type})")
+            if not contexts:
+                print("未找到相关文档")
+                results[i] = {
+                    "question": question,
+                    "answer": "未找到相关文档",
+                    "confidence": 0.0,
+                    "sources": []
+                }
+                continue
+            
+            combined_context = '\n\n'.join(contexts[:3])  # 使用前3个最相关的文档
+            prompt = self._build_prompt(question, combined_context, question_type)
+            print(f"生成的提示词长度: {len(prompt)}")
+            pending.append((i, prompt, combined_context))
+        
+        if pending:
+            print(f"批量生成 {len(pending)} 个答案...")
+            if self.llm and self.llm.model:
+                answers = self.llm.generate_batch(
+                    [prompt for _, prompt, _ in pending], max_length=self.config.MAX_TOKENS
+                )
+            else:
+                # 如果LLM不可用，返回基于检索的简单回答
+                answers = [
+                    f"基于检索到的相关文档，针对问题'{questions[i]}'，相关内容如下：\n{context[:500]}..."
+                    for i, _, context in pending
+                ]
+            
+            for (i, _, combined_context), answer in zip(pending, answers):
+                print(f"问题 {i+1} 生成的答案: {answer[:200]}...")
+                results[i] = {
+                    "question": questions[i],
+                    "answer": answer,
+                    "context_used": combined_context,
+                    "num_sources": len(contexts_list[i])
+                }
+        
+        print(f"批量处理完成")
+        return results
+    
     def get_vector_db_stats(self) -> Dict[str, Any]:
         """获取向量数据库统计信息"""
         if self.vector_db:
@@ -16,6 +16,8 @@ from llama_index.core import Document, VectorStoreIndex, Settings
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.llms.huggingface import HuggingFaceLLM
 
+from llm_utils import tokenize_left_padded
+
 class FixedRAGEngine:
     """修复版本的 RAG 引擎"""
     
@@ -23,10 +25,12 @@ class FixedRAGEngine:
         """初始化RAG引擎"""
         self.config = config
         self.llm = None
+        self.llm_device = None  # 模型输入所在设备，加载成功后缓存
         self.tokenizer = None
         self.embedding_model = None
         self.index = None
         self.query_engine = None
+        self.retriever = None  # 批量查询只做检索，不经过查询引擎的响应合成
         
         # 应用修复补丁
         self._apply_transformers_fix()
@@ -74,7 +78,8 @@ class FixedRAGEngine:
         
         # 设置 transformers 相关环境变量
         os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
-        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        # 推理场景没有 DataLoader 子进程争用，保留 Rust tokenizer 的并行分词
+        os.environ['TOKENIZERS_PARALLELISM'] = 'true'
         os.environ['CUDA_LAUNCH_BLOCKING'] = '1'
         
         print("✅ 环境变量设置完成")
@@ -125,7 +130,8 @@ class FixedRAGEngine:
             print("📝 加载 tokenizer...")
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.config.LLM_MODEL_PATH,
-                trust_remote_code=True
+                trust_remote_code=True,
+                use_fast=True
             )
             print("✅ tokenizer 加载成功")
         except Exception as e:
@@ -149,6 +155,9 @@ class FixedRAGEngine:
                     **strategy['params']
                 )
                 
+                # 缓存输入设备，避免每次生成都遍历模型参数
+                self.llm_device = next(self.llm.parameters()).device
+                
                 print(f"✅ 使用 {strategy['name']} 加载模型成功！")
                 return True
                 
@@ -220,18 +229,17 @@ class FixedRAGEngine:
                 similarity_top_k=self.config.TOP_K,
                 response_mode="compact"
             )
+            self.retriever = self.index.as_retriever(similarity_top_k=self.config.TOP_K)
             print("✅ 向量索引构建完成")
             return True
         except Exception as e:
             print(f"❌ 索引构建失败: {e}")
             return False
     
-    def generate_answer(self, query: str, retrieved_texts: List[str]) -> str:
-        """使用LLM生成答案"""
-        try:
-            # 构建提示词
-            context = "\n\n".join(retrieved_texts)
-            prompt = f"""基于以下文档内容回答问题：
+    def _build_prompt(self, query: str, retrieved_texts: List[str]) -> str:
+        """构建提示词"""
+        context = "\n\n".join(retrieved_texts)
+        return f"""基于以下文档内容回答问题：
 
 文档内容：
 {context}
@@ -239,13 +247,19 @@ class FixedRAGEngine:
 问题：{query}
 
 请根据文档内容准确回答问题："""
+    
+    def generate_answer(self, query: str, retrieved_texts: List[str]) -> str:
+        """使用LLM生成答案"""
+        try:
+            # 构建提示词
+            prompt = self._build_prompt(query, retrieved_texts)
             
             # 使用tokenizer编码
             inputs = self.tokenizer.encode(prompt, return_tensors="pt")
             
             # 移动到正确的设备
-            if torch.cuda.is_available() and next(self.llm.parameters()).is_cuda:
-                inputs = inputs.cuda()
+            if self.llm_device.type == "cuda":
+                inputs = inputs.to(self.llm_device)
             
             # 生成答案
             with torch.no_grad():
@@ -265,6 +279,64 @@ class FixedRAGEngine:
             print(f"❌ 答案生成失败: {e}")
             return f"生成答案时出错: {str(e)}"
     
+    def generate_answers_batch(self, queries: List[str], retrieved_texts_list: List[List[str]]) -> List[str]:
+        """一次 generate 调用为多个问题生成答案（左侧填充后批量解码）"""
+        prompts = [
+            self._build_prompt(query, retrieved_texts)
+            for query, retrieved_texts in zip(queries, retrieved_texts_list)
+        ]
+        
+        inputs = tokenize_left_padded(self.tokenizer, prompts)
+        
+        # 移动到正确的设备
+        if self.llm_device.type == "cuda":
+            inputs = inputs.to(self.llm_device)
+        
+        with torch.no_grad():
+            outputs = self.llm.generate(
+                **inputs,
+                max_new_tokens=512,
+                temperature=0.7,
+                do_sample=True,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
+    
+    def query_batch(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """批量查询接口：逐个检索（仅检索器，不调用LLM），合并为一次批量生成"""
+        if not (self.llm and self.tokenizer) or len(questions) <= 1:
+            return [self.query(question) for question in questions]
+        
+        try:
+            print(f"🔍 批量查询 {len(questions)} 个问题")
+            
+            # 检索阶段仍逐个进行
+            retrieved_texts_list = []
+            for question in questions:
+                nodes = self.retriever.retrieve(question)
+                retrieved_texts_list.append([node.text for node in nodes])
+            
+            answers = self.generate_answers_batch(questions, retrieved_texts_list)
+            
+            return [
+                {
+                    "question": question,
+                    "answer": answer,
+                    "retrieved_texts": retrieved_texts,
+                    "confidence": 0.8  # 简单的置信度
+                }
+                for question, answer, retrieved_texts in zip(questions, answers, retrieved_texts_list)
+            ]
+            
+        except Exception as e:
+            print(f"⚠️  批量查询失败，改为逐个查询: {e}")
+            return [self.query(question) for question in questions]
+    
     def query(self, question: str) -> Dict[str, Any]:
         """查询接口"""
         try:
@@ -307,6 +379,7 @@ class FixedRAGEngine:
         if self.llm:
             del self.llm
             self.llm = None
+            self.llm_device = None
         
         if self.tokenizer:
             del self.tokenizer
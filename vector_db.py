@@ -7,6 +7,8 @@ import os
 import json
 import hashlib
 import pickle
+import sqlite3
+import zlib
 from pathlib import Path
 from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
@@ -19,6 +21,63 @@ from sentence_transformers import SentenceTransformer
 from config import Config
 
 
+class EmbeddingCache:
+    """基于SQLite的嵌入向量磁盘缓存，键为 sha256(嵌入模型路径 + 文本)"""
+    
+    # SQLite单条语句的参数个数有上限，分批查询
+    _QUERY_BATCH = 500
+    
+    def __init__(self, db_path: Path, model_id: str):
+        self.model_id = model_id
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+    
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\n{text}".encode('utf-8')).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """批量读取缓存，返回命中的 键 -> 向量"""
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(unique_keys), self._QUERY_BATCH):
+            batch = unique_keys[i:i + self._QUERY_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+    
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """批量写入缓存（以float32保存，保证与直接编码的结果一致）"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        )
+        self.conn.commit()
+    
+    def prune(self, keep_keys: List[str]) -> int:
+        """删除不在 keep_keys 中的缓存条目，返回删除的条数"""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM keep_keys")
+        self.conn.executemany("INSERT OR IGNORE INTO keep_keys (key) VALUES (?)", [(key,) for key in keep_keys])
+        removed = self.conn.execute(
+            "DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM keep_keys)"
+        ).rowcount
+        self.conn.execute("DELETE FROM keep_keys")
+        self.conn.commit()
+        return removed
+    
+    def clear(self):
+        """清空缓存并回收磁盘空间"""
+        self.conn.execute("DELETE FROM embeddings")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+
+
 class VectorDatabase:
     """向量数据库管理类"""
     
@@ -26,6 +85,7 @@ class VectorDatabase:
         self.config = Config
         self.embedding_model = embedding_model
         self.index = None
+        self._gpu_resources = None  # 索引在GPU上时持有的FAISS GPU资源
         self.document_store = {}  # 存储文档内容和元数据
         self.vector_metadata = {}  # 存储向量元数据
         self.is_loaded = False
@@ -35,35 +95,92 @@ class VectorDatabase:
         self.faiss_index_path = self.vector_db_path / self.config.FAISS_INDEX_FILE
         self.metadata_path = self.vector_db_path / self.config.VECTOR_METADATA_FILE
         self.document_store_path = self.vector_db_path / self.config.DOCUMENT_STORE_FILE
+        self.index_checksum_path = self.faiss_index_path.with_name(self.faiss_index_path.name + '.crc32')
         
         # 确保目录存在
         self.vector_db_path.mkdir(exist_ok=True)
         
+        # 嵌入向量磁盘缓存（跨运行复用，重建索引或重复查询时不必重新编码）
+        self.embedding_cache = None
+        if self.config.EMBEDDING_CACHE_FILE:
+            self.embedding_cache = EmbeddingCache(
+                self.vector_db_path / self.config.EMBEDDING_CACHE_FILE,
+                self.config.EMBEDDING_MODEL_PATH
+            )
+        
         print("向量数据库初始化完成")
     
     def _get_document_hash(self, content: str) -> str:
         """计算文档内容的哈希值，用于检测文档变更"""
         return hashlib.md5(content.encode('utf-8')).hexdigest()
     
-    def _create_faiss_index(self) -> faiss.Index:
-        """创建FAISS索引"""
+    def _get_file_checksum(self, file_path: Path) -> str:
+        """计算文件的CRC32校验值，分块读取以保持内存占用恒定"""
+        crc = 0
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                crc = zlib.crc32(chunk, crc)
+        return f"{crc:08x}"
+    
+    def _verify_index_checksum(self) -> bool:
+        """校验FAISS索引文件是否与保存时一致（旧版本没有校验文件时跳过）"""
+        if not self.index_checksum_path.exists():
+            return True
+        
+        expected = self.index_checksum_path.read_text(encoding='utf-8').strip()
+        actual = self._get_file_checksum(self.faiss_index_path)
+        if actual != expected:
+            print(f"FAISS索引文件校验失败 (期望 {expected}, 实际 {actual})，索引可能已损坏")
+            return False
+        return True
+    
+    def _create_faiss_index(self, num_vectors: int = 0) -> faiss.Index:
+        """创建FAISS索引（IVF类索引需要在添加向量前训练）"""
         dimension = self.config.VECTOR_DIMENSION
+        index_type = self.config.FAISS_INDEX_TYPE
         
-        if self.config.FAISS_INDEX_TYPE == "IndexFlatIP":
-            # 内积索引（适合已标准化的向量）
-            index = faiss.IndexFlatIP(dimension)
-        elif self.config.FAISS_INDEX_TYPE == "IndexFlatL2":
+        if index_type in ("IndexIVFFlat", "IndexIVFPQ"):
+            # 每个聚类中心至少约39个训练样本，语料较少时减少聚类数
+            nlist = max(1, min(self.config.FAISS_IVF_NLIST, num_vectors // 39))
+            min_train = 2 ** self.config.FAISS_PQ_NBITS if index_type == "IndexIVFPQ" else nlist
+            if num_vectors < min_train:
+                print(f"向量数量 {num_vectors} 不足以训练 {index_type}，改用 IndexFlatIP")
+                index_type = "IndexFlatIP"
+        
+        if index_type == "IndexFlatL2":
             # L2距离索引
             index = faiss.IndexFlatL2(dimension)
-        elif self.config.FAISS_INDEX_TYPE == "IndexIVFFlat":
+        elif index_type == "IndexIVFFlat":
             # IVF索引（适合大规模数据）
             quantizer = faiss.IndexFlatIP(dimension)
-            index = faiss.IndexIVFFlat(quantizer, dimension, 100)  # 100个聚类
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        elif index_type == "IndexIVFPQ":
+            # IVF + 乘积量化：每个向量压缩为 FAISS_PQ_M 个字节，适合大规模语料
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist,
+                                     self.config.FAISS_PQ_M, self.config.FAISS_PQ_NBITS,
+                                     faiss.METRIC_INNER_PRODUCT)
         else:
-            # 默认使用内积索引
+            # 默认使用内积索引（适合已标准化的向量）
+            index_type = "IndexFlatIP"
             index = faiss.IndexFlatIP(dimension)
             
-        print(f"创建FAISS索引: {self.config.FAISS_INDEX_TYPE}, 维度: {dimension}")
+        print(f"创建FAISS索引: {index_type}, 维度: {dimension}")
+        return index
+    
+    def _prepare_index_for_search(self, index: faiss.Index) -> faiss.Index:
+        """设置IVF检索参数，并按配置将索引转移到GPU"""
+        if hasattr(index, 'nprobe'):
+            index.nprobe = min(self.config.FAISS_NPROBE, index.nlist)
+        
+        self._gpu_resources = None
+        if self.config.FAISS_USE_GPU:
+            if hasattr(faiss, 'StandardGpuResources') and faiss.get_num_gpus() > 0:
+                self._gpu_resources = faiss.StandardGpuResources()
+                index = faiss.index_cpu_to_gpu(self._gpu_resources, 0, index)
+                print("FAISS索引已转移到GPU")
+            else:
+                print("未检测到faiss-gpu或可用GPU，索引保留在CPU上")
         return index
     
     def _normalize_vectors(self, vectors: np.ndarray) -> np.ndarray:
@@ -75,11 +192,43 @@ class VectorDatabase:
             return vectors / norms
         return vectors
     
-    def encode_texts(self, texts: List[str], show_progress: bool = True) -> np.ndarray:
-        """将文本编码为向量"""
+    def encode_texts(self, texts: List[str], show_progress: bool = True,
+                     use_cache: bool = False) -> np.ndarray:
+        """将文本编码为向量（use_cache=True 时命中磁盘缓存的文本不再调用嵌入模型）"""
         if self.embedding_model is None:
             raise ValueError("嵌入模型未初始化")
         
+        if not use_cache or not self._can_use_embedding_cache():
+            return self._normalize_vectors(self._encode_with_model(texts, show_progress))
+        
+        keys = [self.embedding_cache.make_key(text) for text in texts]
+        vectors_by_key = self.embedding_cache.get_many(keys)
+        
+        # 未命中的文本去重后再编码
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors_by_key:
+                missing.setdefault(key, text)
+        
+        if vectors_by_key:
+            hits = sum(1 for key in keys if key in vectors_by_key)
+            print(f"嵌入缓存命中 {hits}/{len(texts)} 个文本")
+        
+        if missing:
+            new_vectors = self._encode_with_model(list(missing.values()), show_progress)
+            new_items = dict(zip(missing.keys(), new_vectors))
+            self.embedding_cache.put_many(new_items)
+            vectors_by_key.update(new_items)
+        
+        vectors = np.vstack([vectors_by_key[key] for key in keys])
+        return self._normalize_vectors(vectors)
+    
+    def _can_use_embedding_cache(self) -> bool:
+        """嵌入模型未加载时编码结果是随机向量，不能读写缓存；没有 is_loaded 属性的编码器视为已加载"""
+        return self.embedding_cache is not None and getattr(self.embedding_model, 'is_loaded', True)
+    
+    def _encode_with_model(self, texts: List[str], show_progress: bool = True) -> np.ndarray:
+        """调用嵌入模型分批编码文本，返回未标准化的向量"""
         print(f"开始编码 {len(texts)} 个文本片段...")
         
         # 分批编码以节省内存
@@ -115,7 +264,7 @@ class VectorDatabase:
         vectors = np.vstack(all_vectors)
         print(f"编码完成，向量形状: {vectors.shape}")
         
-        return self._normalize_vectors(vectors)
+        return vectors
     
     def build_from_documents(self, documents: List[Dict[str, Any]], 
                            force_rebuild: bool = False) -> bool:
@@ -158,14 +307,27 @@ class VectorDatabase:
         print(f"总共生成 {len(text_chunks)} 个文档片段")
         
         # 编码向量
-        vectors = self.encode_texts(text_chunks)
+        # 只缓存语料片段的向量：重建索引时复用，查询向量不落盘
+        vectors = self.encode_texts(text_chunks, use_cache=True)
+        
+        # 全量重建后只保留当前语料片段的缓存，切片参数变化或文档删除留下的旧向量一并清理
+        if self._can_use_embedding_cache():
+            removed = self.embedding_cache.prune([self.embedding_cache.make_key(chunk) for chunk in text_chunks])
+            if removed:
+                print(f"嵌入缓存清理 {removed} 个过期条目")
         
         # 创建FAISS索引
-        self.index = self._create_faiss_index()
+        vectors = vectors.astype(np.float32)
+        self.index = self._create_faiss_index(len(vectors))
+        
+        if not self.index.is_trained:
+            print("训练FAISS索引...")
+            self.index.train(vectors)
         
         # 添加向量到索引
         print("添加向量到FAISS索引...")
-        self.index.add(vectors.astype(np.float32))
+        self.index.add(vectors)
+        index_type = type(self.index).__name__
         
         # 更新存储
         self.document_store = {
@@ -175,13 +337,14 @@ class VectorDatabase:
         self.vector_metadata = {
             'total_vectors': len(vectors),
             'vector_dimension': vectors.shape[1],
-            'index_type': self.config.FAISS_INDEX_TYPE,
+            'index_type': index_type,
             'created_at': str(pd.Timestamp.now()),
             'document_count': len(documents)
         }
         
         # 持久化保存
         self.save_to_disk()
+        self.index = self._prepare_index_for_search(self.index)
         
         self.is_loaded = True
         print("向量数据库构建完成!")
@@ -232,8 +395,12 @@ class VectorDatabase:
         try:
             print("从磁盘加载向量数据库...")
             
+            # 校验索引文件，避免加载保存时被截断或损坏的索引
+            if not self._verify_index_checksum():
+                return False
+            
             # 加载FAISS索引
-            self.index = faiss.read_index(str(self.faiss_index_path))
+            self.index = self._prepare_index_for_search(faiss.read_index(str(self.faiss_index_path)))
             
             # 加载元数据
             with open(self.metadata_path, 'r', encoding='utf-8') as f:
@@ -256,8 +423,12 @@ class VectorDatabase:
         try:
             print("保存向量数据库到磁盘...")
             
-            # 保存FAISS索引
-            faiss.write_index(self.index, str(self.faiss_index_path))
+            # 保存FAISS索引（GPU索引需先复制回CPU）
+            index = faiss.index_gpu_to_cpu(self.index) if self._gpu_resources is not None else self.index
+            faiss.write_index(index, str(self.faiss_index_path))
+            self.index_checksum_path.write_text(
+                self._get_file_checksum(self.faiss_index_path), encoding='utf-8'
+            )
             
             # 保存元数据
             with open(self.metadata_path, 'w', encoding='utf-8') as f:
@@ -276,34 +447,45 @@ class VectorDatabase:
     
     def search(self, query_text: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
         """搜索相似文档"""
+        return self.search_batch([query_text], top_k=top_k)[0]
+    
+    def search_batch(self, query_texts: List[str], top_k: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """批量搜索相似文档：所有查询一起编码，并执行一次FAISS搜索"""
         if not self.is_loaded or self.index is None:
             raise ValueError("向量数据库未加载")
         
         if top_k is None:
             top_k = self.config.TOP_K
         
+        if not query_texts:
+            return []
+        
         # 编码查询文本
-        query_vector = self.encode_texts([query_text], show_progress=False)
+        query_vectors = self.encode_texts(query_texts, show_progress=False)
         
         # 执行搜索
-        scores, indices = self.index.search(query_vector.astype(np.float32), top_k)
-        
-        # 整理结果
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx >= 0:  # 有效索引
-                chunk_id = list(self.document_store.keys())[idx]
-                chunk_data = self.document_store[chunk_id]
-                
-                results.append({
-                    'chunk_id': chunk_id,
-                    'text': chunk_data['text'],
-                    'score': float(score),
-                    'metadata': chunk_data.get('doc_metadata', {}),
-                    'chunk_index': chunk_data.get('chunk_index', 0)
-                })
-        
-        return results
+        scores, indices = self.index.search(query_vectors.astype(np.float32), top_k)
+        
+        # 整理结果（片段ID列表每次搜索只构建一次）
+        chunk_ids = list(self.document_store.keys())
+        all_results = []
+        for row_scores, row_indices in zip(scores, indices):
+            results = []
+            for score, idx in zip(row_scores, row_indices):
+                if idx >= 0:  # 有效索引
+                    chunk_id = chunk_ids[idx]
+                    chunk_data = self.document_store[chunk_id]
+                    
+                    results.append({
+                        'chunk_id': chunk_id,
+                        'text': chunk_data['text'],
+                        'score': float(score),
+                        'metadata': chunk_data.get('doc_metadata', {}),
+                        'chunk_index': chunk_data.get('chunk_index', 0)
+                    })
+            all_results.append(results)
+        
+        return all_results
     
     def _should_incremental_update(self, documents: List[Dict[str, Any]]) -> bool:
         """判断是否应该进行增量更新"""
@@ -338,12 +520,18 @@ class VectorDatabase:
         print("清空向量数据库...")
         
         # 删除文件
-        for file_path in [self.faiss_index_path, self.metadata_path, self.document_store_path]:
+        for file_path in [self.faiss_index_path, self.index_checksum_path,
+                          self.metadata_path, self.document_store_path]:
             if file_path.exists():
                 file_path.unlink()
         
+        # 嵌入缓存一并清空，重建时全部重新编码
+        if self.embedding_cache is not None:
+            self.embedding_cache.clear()
+        
         # 重置内存状态
         self.index = None
+        self._gpu_resources = None
         self.document_store = {}
         self.vector_metadata = {}
         self.is_loaded = False
@@ -10,8 +10,9 @@ from pathlib import Path
 from typing import List, Dict, Any
 
 from config import Config
-from vector_db import VectorDatabase
-from rag_engine import DocumentProcessor, SimpleEmbedding
+
+# vector_db / rag_engine 会引入 faiss、torch、transformers 等重量级依赖，
+# 延迟到真正需要时再导入，避免 --help 等简单命令也要等待数秒
 
 
 class VectorDBManager:
@@ -20,12 +21,15 @@ class VectorDBManager:
     def __init__(self):
         self.config = Config
         self.vector_db = None
-        self.doc_processor = DocumentProcessor()
+        self.doc_processor = None
         
     def init_embedding_model(self):
         """初始化嵌入模型"""
         print("初始化嵌入模型...")
         try:
+            from vector_db import VectorDatabase
+            from rag_engine import SimpleEmbedding
+            
             # 使用简化的嵌入模型
             embed_model = SimpleEmbedding(self.config.EMBEDDING_MODEL_PATH)
             
@@ -87,6 +91,9 @@ class VectorDBManager:
         
         # 加载文档
         print(f"从目录加载文档: {self.config.DOCUMENTS_DIR}")
+        if self.doc_processor is None:
+            from rag_engine import DocumentProcessor
+            self.doc_processor = DocumentProcessor()
         documents = self.doc_processor.load_documents(self.config.DOCUMENTS_DIR)
         
         if not documents:
@@ -149,6 +156,7 @@ class VectorDBManager:
         print("清空向量数据库...")
         
         if not self.vector_db:
+            from vector_db import VectorDatabase
             self.vector_db = VectorDatabase()
         
         choice = input("确认清空向量数据库? 这将删除所有向量数据 (y/N): ").strip().lower()